@@ -1,13 +1,12 @@
 #!/usr/bin/env python3
 import os
-import glob
 import logging
-import hashlib
 import time
+import random
 import asyncio
 import re
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Chat
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, MessageHandler, filters
+from telegram.ext import Application, AIORateLimiter, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, MessageHandler, filters
 from telegram.constants import ParseMode, ChatType
 from telegram.error import TelegramError, TimedOut, NetworkError, RetryAfter
 import sys
@@ -16,7 +15,16 @@ import atexit
 import fcntl
 import json
 import subprocess
-import requests
+import httpx
+from collections import OrderedDict
+try:
+    import orjson  # C实现，大列表解析/序列化比标准库快数倍
+except ImportError:
+    orjson = None
+try:
+    import ijson  # 流式解析，大channel_titles.json建索引时不用整表驻留内存
+except ImportError:
+    ijson = None
 
 # 配置日志
 logging.basicConfig(
@@ -43,9 +51,6 @@ INITIAL_RETRY_DELAY = 1  # 初始重试延迟（秒）
 MAX_RETRY_DELAY = 60  # 最大重试延迟（秒）
 RETRY_FIRST_FILE_DELAY = 5  # 重试后第一个文件的延迟（秒）
 
-# 书籍映射字典，用于存储短ID到文件名的映射
-book_id_map = {}
-
 # 重试状态跟踪
 retry_status = {
     "is_after_retry": False,
@@ -86,81 +91,166 @@ def release_lock():
 acquire_lock()
 atexit.register(release_lock)
 
+# 目录扫描缓存：{路径: (mtime_ns, 结果)}，目录未变动时直接复用，避免重复扫盘
+_dir_cache = {}
+
+def _scan_dir_cached(path, scan):
+    """按目录mtime缓存扫描结果，目录没变时重复调用不再访问文件系统。
+    用st_mtime_ns做键，秒内连续变动也不会读到过期缓存"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+    cached = _dir_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    result = scan(path)
+    _dir_cache[path] = (mtime, result)
+    return result
+
 # 辅助函数
 def get_categories():
-    """获取所有分类"""
-    return sorted([d for d in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, d))])
+    """获取所有分类（排序只在缓存重建时发生，返回不可变元组供各处共享）"""
+    def scan(path):
+        with os.scandir(path) as it:
+            return tuple(sorted(e.name for e in it if e.is_dir()))
+    return _scan_dir_cached(DATA_DIR, scan)
 
 def get_books_in_category(category):
     """获取分类下的所有书籍"""
-    books_path = os.path.join(DATA_DIR, category, "*.txt")
-    books = glob.glob(books_path)
-    return [os.path.basename(book) for book in books]
-
-def get_short_id(book_name):
-    """生成书籍的短ID"""
-    # 使用哈希函数生成短ID
-    hash_obj = hashlib.md5(book_name.encode())
-    short_id = hash_obj.hexdigest()[:8]  # 取前8位作为短ID
-    
-    # 存储映射关系
-    book_id_map[short_id] = book_name
-    
+    def scan(path):
+        with os.scandir(path) as it:
+            return [e.name for e in it if e.is_file() and e.name.endswith('.txt')]
+    return _scan_dir_cached(os.path.join(DATA_DIR, category), scan)
+
+def get_short_id(context, book_name):
+    """生成书籍的短ID（递增计数分配；映射放在user_data里，
+    每个用户独立，并发使用菜单时互不覆盖，旧回调也不会失效）"""
+    book_ids = context.user_data.setdefault('book_ids', {})
+    short_ids = context.user_data.setdefault('book_short_ids', {})
+    short_id = short_ids.get(book_name)
+    if short_id is None:
+        short_id = format(len(book_ids), 'x')
+        book_ids[short_id] = book_name
+        short_ids[book_name] = short_id
     return short_id
 
+# 数量选择键盘是纯静态的，进程启动时构建一次反复复用
+_COUNT_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("1本", callback_data="count_1"),
+        InlineKeyboardButton("3本", callback_data="count_3"),
+        InlineKeyboardButton("5本", callback_data="count_5")
+    ],
+    [
+        InlineKeyboardButton("10本", callback_data="count_10"),
+        InlineKeyboardButton("全部", callback_data="count_all")
+    ],
+    [InlineKeyboardButton("返回分类选择", callback_data="back_to_categories")]
+])
+
+# 分类键盘缓存：{(回调前缀, 分类元组): InlineKeyboardMarkup}
+_category_keyboard_cache = {}
+
+def build_categories_keyboard(categories, prefix):
+    """构建两列分类键盘，分类列表没变时复用缓存的键盘对象"""
+    key = (prefix, tuple(categories))
+    markup = _category_keyboard_cache.get(key)
+    if markup is None:
+        keyboard = []
+        for i in range(0, len(categories), 2):
+            row = [InlineKeyboardButton(categories[i], callback_data=f"{prefix}{i}")]
+            if i + 1 < len(categories):
+                row.append(InlineKeyboardButton(categories[i+1], callback_data=f"{prefix}{i+1}"))
+            keyboard.append(row)
+        markup = InlineKeyboardMarkup(keyboard)
+        _category_keyboard_cache[key] = markup
+    return markup
+
+# epub文件索引：{分类: {不带后缀的书名: 完整路径}}，任一分类目录变动时重建
+_epub_index = None
+_epub_index_sig = None
+
+def _epub_dir_signature():
+    """EPUB_DIR各分类子目录的st_mtime_ns签名。
+    子目录里增删epub只改子目录自己的mtime、不改EPUB_DIR的，
+    所以失效判断必须落到每个分类目录上"""
+    try:
+        with os.scandir(EPUB_DIR) as it:
+            return tuple(sorted(
+                (e.name, e.stat(follow_symlinks=False).st_mtime_ns)
+                for e in it if e.is_dir(follow_symlinks=False)
+            ))
+    except OSError:
+        return None
+
+def _build_epub_index():
+    """一次性扫描EPUB_DIR所有分类，按分类建立书名到路径的索引"""
+    index = {}
+    with os.scandir(EPUB_DIR) as categories:
+        for cat in categories:
+            # follow_symlinks=False直接用目录项的类型信息，不额外stat
+            if not cat.is_dir(follow_symlinks=False):
+                continue
+            books = {}
+            with os.scandir(cat.path) as files:
+                for entry in files:
+                    if entry.is_file(follow_symlinks=False) and entry.name.endswith('.epub'):
+                        books[entry.name[:-5]] = entry.path
+            index[cat.name] = books
+    return index
+
 def find_epub_file(book_name, category):
-    """查找对应的epub文件"""
+    """查找对应的epub文件（内存索引O(1)查找，不再逐目录扫盘）"""
+    global _epub_index, _epub_index_sig
     # 移除.txt后缀
     book_name = book_name[:-4] if book_name.endswith('.txt') else book_name
-    
-    # 在原始epub目录中查找
-    epub_category_path = os.path.join(EPUB_DIR, category)
-    if os.path.exists(epub_category_path):
-        epub_path = os.path.join(epub_category_path, f"{book_name}.epub")
-        if os.path.exists(epub_path):
-            return epub_path
-    
-    # 如果在原始目录中找不到，尝试在所有分类中查找
-    for cat in os.listdir(EPUB_DIR):
-        if os.path.isdir(os.path.join(EPUB_DIR, cat)):
-            epub_path = os.path.join(EPUB_DIR, cat, f"{book_name}.epub")
-            if os.path.exists(epub_path):
-                return epub_path
-    
+
+    sig = _epub_dir_signature()
+    if sig is None:
+        return None
+    if _epub_index is None or _epub_index_sig != sig:
+        _epub_index = _build_epub_index()
+        _epub_index_sig = sig
+
+    # 与旧的逐目录查找优先级一致：先查指定分类，同名书不会串到别的分类
+    path = _epub_index.get(category, {}).get(book_name)
+    if path:
+        return path
+    for cat_name, books in _epub_index.items():
+        if cat_name != category:
+            path = books.get(book_name)
+            if path:
+                return path
     return None
 
+# 书籍信息字段匹配：单次扫描定位 标题/作者/简介，代替逐行startswith
+_FIELD_RE = re.compile(r'^(标题|作者|简介)：[ \t]*(.*)', re.M)
+
 def read_book_info(category, book_name):
     """读取书籍信息"""
     file_path = os.path.join(DATA_DIR, category, book_name)
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
-        
-        # 解析内容
-        title = ""
-        author = ""
-        intro = ""
-        
-        lines = content.split('\n')
-        for i, line in enumerate(lines):
-            if line.startswith("标题："):
-                title = line.replace("标题：", "").strip()
-            elif line.startswith("作者："):
-                author = line.replace("作者：", "").strip()
-            elif line.startswith("简介："):
-                # 简介可能有多行
-                intro_lines = []
-                j = i + 1
-                while j < len(lines) and not lines[j].startswith("标题：") and not lines[j].startswith("作者："):
-                    if lines[j].strip():  # 只添加非空行
-                        intro_lines.append(lines[j])
-                    j += 1
-                intro = "\n".join(intro_lines)
-        
+
+        # 解析内容：一次正则扫描，按匹配到的字段名直接入字典，无逐项比较
+        fields = {}
+        matches = list(_FIELD_RE.finditer(content))
+        for i, m in enumerate(matches):
+            field = m.group(1)
+            if field == "简介":
+                # 简介可能有多行，截取到下一个字段（或文件末尾）
+                end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
+                intro_lines = [line for line in content[m.end():end].split('\n') if line.strip()]
+                fields[field] = "\n".join(intro_lines)
+            else:
+                fields[field] = m.group(2).strip()
+
         return {
-            "title": title or book_name.replace(".txt", ""),
-            "author": author or "未知作者",
-            "intro": intro or "暂无简介"
+            "title": fields.get("标题") or book_name.replace(".txt", ""),
+            "author": fields.get("作者") or "未知作者",
+            "intro": fields.get("简介") or "暂无简介"
         }
     except Exception as e:
         logger.error(f"读取书籍信息出错: {e}")
@@ -170,14 +260,14 @@ def read_book_info(category, book_name):
             "intro": "暂无简介"
         }
 
+def _read_file_bytes(path):
+    """同步读文件内容，供 asyncio.to_thread 在线程池中调用"""
+    with open(path, 'rb') as f:
+        return f.read()
+
 def process_text_for_telegram(text):
-    """处理文本，确保省略号正确显示，同时转义其他特殊字符"""
-    if not text:
-        return ""
-    
-    # 完全禁用Markdown解析，直接返回原始文本
-    # 这样省略号和其他特殊字符都会原样显示
-    return text
+    """处理文本：完全禁用Markdown解析，原样返回（省略号等特殊字符不转义）"""
+    return text or ""
 
 # 添加重试装饰器函数
 async def with_retry(func, *args, **kwargs):
@@ -205,35 +295,23 @@ async def with_retry(func, *args, **kwargs):
             await asyncio.sleep(delay)
         except RetryAfter as e:
             retry_count += 1
-            wait_time = int(e.retry_after) + 1
             if retry_count > MAX_RETRIES:
                 logger.error(f"达到最大重试次数 ({MAX_RETRIES})，操作失败: {e}")
                 raise
-            wait_message = f"Telegram流量限制，需等待 {wait_time} 秒后才能发送，正在等待... (尝试 {retry_count}/{MAX_RETRIES})"
+            # 整段sleep一次并加随机抖动；不再每5秒edit倒计时——
+            # 每次edit本身也是API调用，等待期间反而容易二次流控
+            wait_time = (int(e.retry_after) + 1) * random.uniform(1.0, 1.5)
+            wait_message = f"Telegram流量限制，需等待 {int(wait_time)} 秒后才能发送，正在等待... (尝试 {retry_count}/{MAX_RETRIES})"
             logger.info(wait_message)
-            sent_msg = None
             if chat_id and context and hasattr(context, 'bot'):
                 try:
-                    sent_msg = await context.bot.send_message(
+                    await context.bot.send_message(
                         chat_id=chat_id,
                         text=wait_message
                     )
                 except Exception as notify_error:
                     logger.error(f"通知用户等待时间失败: {notify_error}")
-            # 实时倒计时通知，edit失败则静默等待
-            for left in range(wait_time, 0, -5):
-                await asyncio.sleep(5 if left > 5 else left)
-                left_new = left - 5 if left > 5 else 0
-                if sent_msg and chat_id and context and hasattr(context, 'bot') and left_new > 0:
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=sent_msg.message_id,
-                            text=f"Telegram流量限制，剩余 {left_new} 秒... (尝试 {retry_count}/{MAX_RETRIES})"
-                        )
-                    except Exception as edit_error:
-                        logger.error(f"更新等待时间失败: {edit_error}，本次edit跳过")
-                        break  # edit失败直接跳出倒计时，避免二次流控
+            await asyncio.sleep(wait_time)
             retry_status["just_retried"] = True
         except (NetworkError, TimedOut) as e:
             retry_count += 1
@@ -254,6 +332,15 @@ async def with_retry(func, *args, **kwargs):
             logger.error(f"未预期的错误，不重试: {e}")
             raise
 
+# 触发本地同步服务用的异步HTTP客户端（懒加载复用，避免阻塞事件循环）
+_http_client = None
+
+def _get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=3)
+    return _http_client
+
 # 新增：主菜单按钮回调
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
@@ -294,7 +381,7 @@ async def menu_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif query.data == 'menu_fetch':
         await query.edit_message_text("正在同步频道，请稍候...（大约1-2分钟）")
         try:
-            resp = requests.post('http://127.0.0.1:5000/sync', timeout=3)
+            resp = await _get_http_client().post('http://127.0.0.1:5000/sync')
             if resp.status_code == 200:
                 await query.message.reply_text("频道同步已启动，稍后请刷新页面或重新点击补发/上传。")
             else:
@@ -324,7 +411,7 @@ async def upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def normalize_channel_id(channel_id):
     channel_id = channel_id.strip()
-    if channel_id.startswith("https://t.me/") or channel_id.startswith("http://t.me/"):
+    if channel_id.startswith(("https://t.me/", "http://t.me/")):
         channel_id = "@" + channel_id.split("/")[-1]
     return channel_id
 
@@ -334,21 +421,12 @@ async def channel_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # 继续选择分类
     categories = get_categories()
-    
-    # 创建分类键盘
-    keyboard = []
-    for i in range(0, len(categories), 2):
-        row = []
-        row.append(InlineKeyboardButton(categories[i], callback_data=f"cat_{i}"))
-        if i + 1 < len(categories):
-            row.append(InlineKeyboardButton(categories[i+1], callback_data=f"cat_{i+1}"))
-        keyboard.append(row)
-    
+
     # 存储分类映射
     context.user_data["categories"] = categories
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await with_retry(update.message.reply_text, 
+
+    reply_markup = build_categories_keyboard(categories, "cat_")
+    await with_retry(update.message.reply_text,
         f"将上传到频道: {channel_id}\n请选择要上传的电子书分类：", 
         reply_markup=reply_markup,
         context=context
@@ -364,22 +442,8 @@ async def category_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cat_index = int(query.data.replace("cat_", ""))
     category = context.user_data["categories"][cat_index]
     context.user_data["category"] = category
-    
-    # 创建数量选择键盘
-    keyboard = [
-        [
-            InlineKeyboardButton("1本", callback_data="count_1"),
-            InlineKeyboardButton("3本", callback_data="count_3"),
-            InlineKeyboardButton("5本", callback_data="count_5")
-        ],
-        [
-            InlineKeyboardButton("10本", callback_data="count_10"),
-            InlineKeyboardButton("全部", callback_data="count_all")
-        ],
-        [InlineKeyboardButton("返回分类选择", callback_data="back_to_categories")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    reply_markup = _COUNT_KEYBOARD
     await with_retry(query.edit_message_text,
         f"已选择分类: {category}\n请选择要上传的电子书数量：", 
         reply_markup=reply_markup,
@@ -395,15 +459,7 @@ async def count_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if query.data == "back_to_categories":
         categories = context.user_data["categories"]
-        keyboard = []
-        for i in range(0, len(categories), 2):
-            row = []
-            row.append(InlineKeyboardButton(categories[i], callback_data=f"cat_{i}"))
-            if i + 1 < len(categories):
-                row.append(InlineKeyboardButton(categories[i+1], callback_data=f"cat_{i+1}"))
-            keyboard.append(row)
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = build_categories_keyboard(categories, "cat_")
         await with_retry(query.edit_message_text,
             f"将上传到频道: {context.user_data['channel_id']}\n请选择要上传的电子书分类：", 
             reply_markup=reply_markup,
@@ -424,23 +480,15 @@ async def count_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context=context
         )
         
-        success_count = 0
-        skip_count = 0
-        
         # 重置重试状态
         global retry_status
         retry_status = {
             "is_after_retry": False,
             "retry_count": 0
         }
-        
-        for book in books:
-            result = await upload_book(update, context, category, book)
-            if result:
-                success_count += 1
-            else:
-                skip_count += 1
-        
+
+        success_count, skip_count = await upload_books_bulk(update, context, category, books)
+
         await with_retry(query.message.reply_text,
             f"已完成 {category} 分类下电子书的上传！\n成功: {success_count} 本\n跳过: {skip_count} 本",
             context=context
@@ -450,15 +498,16 @@ async def count_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 显示书籍选择
         count = int(count)
         context.user_data["remaining_count"] = count
-        context.user_data["selected_books"] = []
+        # 缓存书籍列表，选中的书用set记录，后续点击不再扫目录
+        context.user_data["all_books"] = books
+        context.user_data["selected_books"] = set()
         
         # 创建书籍选择键盘
         keyboard = []
-        book_id_map.clear()  # 清空之前的映射
         
         for i in range(0, min(10, len(books)), 1):
             book_name = books[i].replace(".txt", "")
-            short_id = get_short_id(books[i])
+            short_id = get_short_id(context, books[i])
             
             if len(book_name) > 30:
                 book_name = book_name[:27] + "..."
@@ -483,20 +532,7 @@ async def book_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if query.data == "back_to_count":
         category = context.user_data["category"]
-        keyboard = [
-            [
-                InlineKeyboardButton("1本", callback_data="count_1"),
-                InlineKeyboardButton("3本", callback_data="count_3"),
-                InlineKeyboardButton("5本", callback_data="count_5")
-            ],
-            [
-                InlineKeyboardButton("10本", callback_data="count_10"),
-                InlineKeyboardButton("全部", callback_data="count_all")
-            ],
-            [InlineKeyboardButton("返回分类选择", callback_data="back_to_categories")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _COUNT_KEYBOARD
         await with_retry(query.edit_message_text,
             f"已选择分类: {category}\n请选择要上传的电子书数量：", 
             reply_markup=reply_markup,
@@ -505,7 +541,7 @@ async def book_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SELECTING_COUNT
     
     short_id = query.data.replace("book_", "")
-    book = book_id_map.get(short_id)
+    book = context.user_data.get('book_ids', {}).get(short_id)
     
     if not book:
         await with_retry(query.message.reply_text, 
@@ -529,7 +565,7 @@ async def book_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 更新剩余数量
     if result:  # 只有成功上传才计数
         context.user_data["remaining_count"] -= 1
-    context.user_data["selected_books"].append(book)
+    context.user_data["selected_books"].add(book)
     
     if context.user_data["remaining_count"] <= 0:
         await with_retry(query.message.reply_text, 
@@ -538,16 +574,15 @@ async def book_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
     else:
-        # 更新书籍选择键盘，排除已选择的书籍
-        books = get_books_in_category(category)
-        books = [b for b in books if b not in context.user_data["selected_books"]]
+        # 更新书籍选择键盘，排除已选择的书籍（用缓存列表+set查找，不再扫目录）
+        selected = context.user_data["selected_books"]
+        books = [b for b in context.user_data["all_books"] if b not in selected]
         
         keyboard = []
-        book_id_map.clear()  # 清空之前的映射
         
         for i in range(0, min(10, len(books)), 1):
             book_name = books[i].replace(".txt", "")
-            short_id = get_short_id(books[i])
+            short_id = get_short_id(context, books[i])
             
             if len(book_name) > 30:
                 book_name = book_name[:27] + "..."
@@ -564,23 +599,137 @@ async def book_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         return SELECTING_BOOK
 
+# 已发书名记录：启动时加载一次到内存，之后只追加ndjson日志，
+# 避免每上传一本书就全量重写 sent_titles.json
+SENT_TITLES_PATH = 'sent_titles.json'
+SENT_TITLES_LOG_PATH = 'sent_titles.ndjson'
+SENT_TITLES_CONSOLIDATE_EVERY = 200  # 每N次追加后合并一次正式JSON
+
+def _load_sent_titles():
+    """启动时加载已发书名集合（正式JSON + 未合并的追加日志）"""
+    titles = set()
+    loads = orjson.loads if orjson else json.loads
+    try:
+        if os.path.exists(SENT_TITLES_PATH):
+            with open(SENT_TITLES_PATH, 'rb') as f:
+                raw = f.read()
+            if raw:
+                titles.update(loads(raw))
+        if os.path.exists(SENT_TITLES_LOG_PATH):
+            with open(SENT_TITLES_LOG_PATH, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        titles.add(loads(line))
+    except Exception as e:
+        logger.error(f'加载已发书名失败: {e}')
+    return titles
+
+SENT_TITLES = _load_sent_titles()
+_sent_log_fp = None
+_sent_log_writes = 0
+
+def _consolidate_sent_titles():
+    """把内存集合落盘为正式JSON，并清空追加日志"""
+    global _sent_log_fp
+    if orjson:
+        with open(SENT_TITLES_PATH, 'wb') as f:
+            f.write(orjson.dumps(list(SENT_TITLES), option=orjson.OPT_INDENT_2))
+    else:
+        with open(SENT_TITLES_PATH, 'w', encoding='utf-8') as f:
+            json.dump(list(SENT_TITLES), f, ensure_ascii=False, indent=2)
+    if _sent_log_fp:
+        _sent_log_fp.close()
+        _sent_log_fp = None
+    if os.path.exists(SENT_TITLES_LOG_PATH):
+        os.remove(SENT_TITLES_LOG_PATH)
+
 # 工具函数：记录已发书名（只用文件名）
 def record_sent_title(title):
-    sent_titles_path = 'sent_titles.json'
+    global _sent_log_fp, _sent_log_writes
+    title = title.strip()
+    if title in SENT_TITLES:
+        return
+    SENT_TITLES.add(title)
     try:
-        if os.path.exists(sent_titles_path):
-            with open(sent_titles_path, 'r', encoding='utf-8') as f:
-                sent_titles = set(json.load(f))
-        else:
-            sent_titles = set()
-        sent_titles.add(title.strip())
-        with open(sent_titles_path, 'w', encoding='utf-8') as f:
-            json.dump(list(sent_titles), f, ensure_ascii=False, indent=2)
+        if _sent_log_fp is None:
+            _sent_log_fp = open(SENT_TITLES_LOG_PATH, 'a', encoding='utf-8')
+        _sent_log_fp.write(json.dumps(title, ensure_ascii=False) + '\n')
+        _sent_log_fp.flush()
+        _sent_log_writes += 1
+        if _sent_log_writes % SENT_TITLES_CONSOLIDATE_EVERY == 0:
+            _consolidate_sent_titles()
     except Exception as e:
-        logger.error(f'写入 sent_titles.json 失败: {e}')
+        logger.error(f'写入已发书名记录失败: {e}')
+
+atexit.register(lambda: _consolidate_sent_titles() if _sent_log_fp else None)
+
+# 批量上传时的预读并发数
+UPLOAD_PREFETCH = 4
+
+# 流控后的冷却通知/等待锁：retry_status的标志协议假定串行上传，
+# 并发补发时靠它保证整批只通知、只等待一次，其余任务在锁上排队等冷却结束
+_flood_cooldown_lock = asyncio.Lock()
+
+def _epub_nonempty(path):
+    """单次stat判断epub文件存在且非空（此前exists+getsize要两次系统调用）"""
+    if not path:
+        return False
+    try:
+        return os.stat(path).st_size > 0
+    except OSError:
+        return False
+
+async def _prepare_book(category, book_name):
+    """预读一本书的信息和epub内容（读盘走线程池，可与网络发送重叠）"""
+    book_info = read_book_info(category, book_name)
+    epub_path = find_epub_file(book_name, category)
+    epub_data = None
+    if _epub_nonempty(epub_path):
+        epub_data = await asyncio.to_thread(_read_file_bytes, epub_path)
+    return {"book_info": book_info, "epub_path": epub_path, "epub_data": epub_data}
+
+async def upload_books_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE, category, books, force_channel_id=None):
+    """批量上传：发送当前书的同时预读后面的书，重叠本地I/O与网络延迟"""
+    success_count = 0
+    skip_count = 0
+    # 信号量限制预读深度，消费一本释放一个，避免把整批epub读进内存
+    prefetch_sem = asyncio.Semaphore(UPLOAD_PREFETCH)
+
+    async def prefetch(book):
+        await prefetch_sem.acquire()
+        return await _prepare_book(category, book)
+
+    tasks = [asyncio.create_task(prefetch(book)) for book in books]
+    try:
+        for book, task in zip(books, tasks):
+            if STOP_FLAG:
+                break
+            try:
+                prepared = await task
+            except Exception as e:
+                # 预读失败（如文件在stat和读取之间被移走）只算跳过这一本，
+                # 不让异常中断整批；信号量已在prefetch里占用，这里补释放
+                logger.error(f"预读 {book} 失败: {e}")
+                prefetch_sem.release()
+                skip_count += 1
+                continue
+            try:
+                result = await upload_book(update, context, category, book,
+                                           force_channel_id=force_channel_id, prepared=prepared)
+            finally:
+                prefetch_sem.release()
+            if result:
+                success_count += 1
+            else:
+                skip_count += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+    return success_count, skip_count
 
 # 修改 upload_book 发送文档和记录逻辑
-async def upload_book(update: Update, context: ContextTypes.DEFAULT_TYPE, category, book_name, force_channel_id=None):
+async def upload_book(update: Update, context: ContextTypes.DEFAULT_TYPE, category, book_name, force_channel_id=None, prepared=None):
     """上传单本电子书，如果找不到epub文件则跳过。异常时不影响后续。"""
     global retry_status, STOP_FLAG
     if STOP_FLAG:
@@ -588,21 +737,32 @@ async def upload_book(update: Update, context: ContextTypes.DEFAULT_TYPE, catego
     try:
         if STOP_FLAG:
             return
-        # 检查是否刚刚流控过，延迟更久
+        # 检查是否刚刚流控过，延迟更久；拿锁后二次检查标志，
+        # 并发任务里只有第一个会通知并等待，其余等它清完标志直接通过
         if retry_status.get("just_retried"):
-            logger.info("检测到刚刚流控，延迟15秒以避免再次触发")
-            await with_retry(context.bot.send_message,
-                chat_id=update.effective_chat.id,
-                text="检测到刚刚流控，正在等待15秒以确保稳定...",
-                context=context
-            )
-            await asyncio.sleep(15)
-            retry_status["just_retried"] = False
-        # 读取书籍信息
-        book_info = read_book_info(category, book_name)
-        epub_path = find_epub_file(book_name, category)
-        # 新增：判断epub文件是否存在且非空
-        if not epub_path or not os.path.exists(epub_path) or os.path.getsize(epub_path) == 0:
+            async with _flood_cooldown_lock:
+                if retry_status.get("just_retried"):
+                    logger.info("检测到刚刚流控，延迟15秒以避免再次触发")
+                    await with_retry(context.bot.send_message,
+                        chat_id=update.effective_chat.id,
+                        text="检测到刚刚流控，正在等待15秒以确保稳定...",
+                        context=context
+                    )
+                    await asyncio.sleep(15)
+                    retry_status["just_retried"] = False
+        # 读取书籍信息（批量上传时由 _prepare_book 预读好）
+        if prepared is not None:
+            book_info = prepared["book_info"]
+            epub_path = prepared["epub_path"]
+            epub_data = prepared["epub_data"]
+            epub_ok = epub_data is not None
+        else:
+            book_info = read_book_info(category, book_name)
+            epub_path = find_epub_file(book_name, category)
+            epub_data = None
+            epub_ok = _epub_nonempty(epub_path)
+        # 判断epub文件是否存在且非空
+        if not epub_ok:
             await with_retry(context.bot.send_message,
                 chat_id=update.effective_chat.id,
                 text=f"跳过 {book_info['title']}：epub文件不存在或为空",
@@ -626,14 +786,20 @@ async def upload_book(update: Update, context: ContextTypes.DEFAULT_TYPE, catego
         # 关键：补发时强制用频道ID
         channel_id = force_channel_id if force_channel_id else context.user_data.get("channel_id", update.effective_chat.id)
         if retry_status["is_after_retry"]:
-            logger.info(f"检测到重试后的首次上传，添加{RETRY_FIRST_FILE_DELAY}秒延迟")
-            await with_retry(context.bot.send_message,
-                chat_id=update.effective_chat.id,
-                text=f"检测到重试后的首次上传，正在等待{RETRY_FIRST_FILE_DELAY}秒以确保稳定...",
-                context=context
-            )
-            await asyncio.sleep(RETRY_FIRST_FILE_DELAY)
-            retry_status["is_after_retry"] = False
+            # 同just_retried：锁+二次检查，重试后的稳定等待整批只做一次
+            async with _flood_cooldown_lock:
+                if retry_status["is_after_retry"]:
+                    logger.info(f"检测到重试后的首次上传，添加{RETRY_FIRST_FILE_DELAY}秒延迟")
+                    await with_retry(context.bot.send_message,
+                        chat_id=update.effective_chat.id,
+                        text=f"检测到重试后的首次上传，正在等待{RETRY_FIRST_FILE_DELAY}秒以确保稳定...",
+                        context=context
+                    )
+                    await asyncio.sleep(RETRY_FIRST_FILE_DELAY)
+                    retry_status["is_after_retry"] = False
+        # 文件只读一次（线程池中读，不阻塞事件循环），重试时复用同一份缓冲
+        if epub_data is None:
+            epub_data = await asyncio.to_thread(_read_file_bytes, epub_path)
         max_upload_attempts = 3
         upload_attempt = 0
         upload_success = False
@@ -645,7 +811,8 @@ async def upload_book(update: Update, context: ContextTypes.DEFAULT_TYPE, catego
                 # 上传操作加超时保护
                 await with_retry(context.bot.send_document,
                     chat_id=channel_id,
-                    document=open(epub_path, 'rb'),
+                    document=epub_data,
+                    filename=os.path.basename(epub_path),
                     caption=message,
                     parse_mode=None,
                     context=context
@@ -706,15 +873,8 @@ async def upload_from_channel_input(update: Update, context: ContextTypes.DEFAUL
     channel_id = normalize_channel_id(update.message.text)
     context.user_data["channel_id"] = channel_id
     categories = get_categories()
-    keyboard = []
-    for i in range(0, len(categories), 2):
-        row = []
-        row.append(InlineKeyboardButton(categories[i], callback_data=f"catfrom_{i}"))
-        if i + 1 < len(categories):
-            row.append(InlineKeyboardButton(categories[i+1], callback_data=f"catfrom_{i+1}"))
-        keyboard.append(row)
     context.user_data["categories_from"] = categories
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = build_categories_keyboard(categories, "catfrom_")
     await with_retry(update.message.reply_text,
         "请选择要上传的电子书分类：",
         reply_markup=reply_markup,
@@ -739,17 +899,21 @@ async def input_search_keyword(update: Update, context: ContextTypes.DEFAULT_TYP
     category = context.user_data["category_from"]
     books = get_books_in_category(category)
     books_no_ext = [b[:-4] if b.endswith('.txt') else b for b in books]
-    # 模糊匹配
-    matched = [b for b in books_no_ext if keyword in b]
+    # 模糊匹配：最多显示10本，凑满就提前结束，不再全量过滤；
+    # 扫描时顺带记下下标，省掉每个结果一次O(N)的index查找
+    matched = []
+    for idx, b in enumerate(books_no_ext):
+        if keyword in b:
+            matched.append((idx, b))
+            if len(matched) >= 10:
+                break
     if not matched:
         await with_retry(update.message.reply_text,
             f"未找到包含关键字'{keyword}'的书名，请重新输入：",
             context=context
         )
         return INPUT_SEARCH_KEYWORD
-    # 最多显示10本
-    matched = matched[:10]
-    keyboard = [[InlineKeyboardButton(b, callback_data=f"startbook_{books_no_ext.index(b)}")] for b in matched]
+    keyboard = [[InlineKeyboardButton(b, callback_data=f"startbook_{idx}")] for idx, b in matched]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await with_retry(update.message.reply_text,
         f"找到以下书名，请点击选择起始书：",
@@ -781,20 +945,13 @@ async def select_start_book(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"将从 {start_book} 之后开始上传，共 {len(books_to_upload)} 本...",
         context=context
     )
-    success_count = 0
-    skip_count = 0
     global retry_status
     retry_status = {
         "is_after_retry": False,
         "retry_count": 0,
         "just_retried": False
     }
-    for book in books_to_upload:
-        result = await upload_book(update, context, category, book)
-        if result:
-            success_count += 1
-        else:
-            skip_count += 1
+    success_count, skip_count = await upload_books_bulk(update, context, category, books_to_upload)
     await with_retry(context.bot.send_message,
         chat_id=update.effective_chat.id,
         text=f"已完成上传！\n成功: {success_count} 本\n跳过: {skip_count} 本",
@@ -826,6 +983,11 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"stop通知失败: {e}")
     logger.info(f"管理员{user_id}触发/stop，机器人即将退出。")
+    if _http_client is not None:
+        try:
+            await _http_client.aclose()
+        except Exception:
+            pass
     try:
         await context.application.stop()
     except Exception as e:
@@ -846,23 +1008,97 @@ async def check_and_fill_channel_input(update: Update, context: ContextTypes.DEF
     # 展示分类选择
     categories = get_categories()
     context.user_data['check_categories'] = categories
-    keyboard = []
-    for i in range(0, len(categories), 2):
-        row = []
-        row.append(InlineKeyboardButton(categories[i], callback_data=f"checkcat_{i}"))
-        if i + 1 < len(categories):
-            row.append(InlineKeyboardButton(categories[i+1], callback_data=f"checkcat_{i+1}"))
-        keyboard.append(row)
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = build_categories_keyboard(categories, "checkcat_")
     await with_retry(update.message.reply_text, "请选择要检查的分类：", reply_markup=reply_markup, context=context)
     return CHECK_CATEGORY
 
+# 文件名归一化正则：模块级编译一次；lower之后"非字母数字汉字"这一类
+# 本身就覆盖了空格/下划线/短横线，单趟替换即可
+_NORM_STRIP_RE = re.compile(r'[^a-z0-9\u4e00-\u9fa5]')
+# 分类名 - 转 _ 的翻译表：C级单遍替换，后续再添规则也只过一遍
+_DASH_TABLE = str.maketrans({'-': '_'})
+
 def normalize_filename(name):
     """宽松化文件名：小写、去除空格、下划线、短横线、所有非字母数字字符"""
-    name = name.lower()
-    name = re.sub(r'[\s_\-]', '', name)
-    name = re.sub(r'[^a-z0-9\u4e00-\u9fa5]', '', name)
-    return name
+    return _NORM_STRIP_RE.sub('', name.lower())
+
+# channel_titles.json 的分类索引缓存：{分类(统一为_): 归一化文件名集合}，
+# 文件mtime没变时各次检查直接复用，不再整文件重读重扫
+CHANNEL_TITLES_PATH = 'channel_titles.json'
+_channel_index = {}
+_channel_index_mtime = None
+
+def _load_channel_index():
+    """读取并按分类索引频道已发文件名，mtime变化时才重建"""
+    global _channel_index, _channel_index_mtime
+    try:
+        # st_mtime_ns为整数纳秒，比浮点st_mtime比较更精确，
+        # 同秒内的连写也能触发重建
+        mtime = os.stat(CHANNEL_TITLES_PATH).st_mtime_ns
+    except OSError:
+        return {}
+    if _channel_index_mtime == mtime:
+        return _channel_index
+    index = {}
+    # 注意 category 的 - 和 _ 兼容；热循环里把方法查找提前绑定到局部名，
+    # 大文件下每条少几次属性查找
+    norm = normalize_filename
+    setdefault = index.setdefault
+    with open(CHANNEL_TITLES_PATH, 'rb') as f:
+        # 优先用ijson流式逐条消费，峰值内存不随文件大小增长；
+        # 缺ijson时退回整表json.load
+        if ijson is not None:
+            channel_data = ijson.items(f, 'item')
+        else:
+            channel_data = json.load(f)
+        for entry in channel_data:
+            if isinstance(entry, dict):
+                fn = entry.get('filename', '').strip()
+                if fn:
+                    entry_cat = entry.get('category', '').translate(_DASH_TABLE)
+                    setdefault(entry_cat, set()).add(norm(fn))
+    _channel_index = index
+    _channel_index_mtime = mtime
+    return index
+
+# 检查结果的小型LRU缓存：分类目录和channel_titles.json都没变时，
+# 重复检查直接复用上次算出的缺失清单，跳过scandir+归一化+差集
+_check_missing_cache = OrderedDict()
+_CHECK_MISSING_CACHE_MAX = 32
+
+def _get_missing_books(category):
+    """计算分类下本地有而频道缺的书名列表（已排序），结果按mtime做LRU缓存"""
+    category_path = os.path.join("new_categorized_books_副本", category)
+    try:
+        cache_key = (
+            os.stat(category_path).st_mtime_ns,
+            os.stat(CHANNEL_TITLES_PATH).st_mtime_ns,
+            category,
+        )
+    except OSError:
+        cache_key = None
+    if cache_key is not None and cache_key in _check_missing_cache:
+        _check_missing_cache.move_to_end(cache_key)
+        return _check_missing_cache[cache_key]
+    # 只取当前分类下的频道文件名（索引已做 - 和 _ 兼容）
+    channel_filenames = _load_channel_index().get(category.translate(_DASH_TABLE), set())
+    # 获取本地分类下所有 epub 文件名：单次scandir建立 归一化名->原始名 映射，
+    # 缺失集合直接做差集，原始名从映射反查，不再二次glob+归一化
+    norm2orig = {}
+    if os.path.isdir(category_path):
+        with os.scandir(category_path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False) and entry.name.endswith('.epub'):
+                    stem = entry.name[:-5]
+                    norm2orig[normalize_filename(stem)] = stem
+    # dict.keys()视图可直接做差集，不用先拷贝成set
+    missing_norm = norm2orig.keys() - channel_filenames
+    display_missing = sorted(norm2orig[n] for n in missing_norm)
+    if cache_key is not None:
+        _check_missing_cache[cache_key] = display_missing
+        if len(_check_missing_cache) > _CHECK_MISSING_CACHE_MAX:
+            _check_missing_cache.popitem(last=False)
+    return display_missing
 
 async def check_and_fill_category_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -870,33 +1106,7 @@ async def check_and_fill_category_selected(update: Update, context: ContextTypes
     cat_index = int(query.data.replace("checkcat_", ""))
     category = context.user_data['check_categories'][cat_index]
     context.user_data['check_category'] = category
-    # 读取 channel_titles.json
-    channel_titles_path = 'channel_titles.json'
-    channel_filenames = set()
-    if os.path.exists(channel_titles_path):
-        with open(channel_titles_path, 'r', encoding='utf-8') as f:
-            channel_data = json.load(f)
-            # 只取当前分类下的 filename，注意 category 的 - 和 _ 兼容
-            for entry in channel_data:
-                if isinstance(entry, dict):
-                    entry_cat = entry.get('category', '').replace('-', '_')
-                    if entry_cat == category.replace('-', '_'):
-                        fn = entry.get('filename', '').strip()
-                        if fn:
-                            channel_filenames.add(normalize_filename(fn))
-    # 获取本地分类下所有 epub 文件名
-    local_titles = set()
-    category_path = os.path.join("new_categorized_books_副本", category)
-    for epub_path in glob.glob(os.path.join(category_path, "*.epub")):
-        file_title = os.path.splitext(os.path.basename(epub_path))[0]
-        local_titles.add(normalize_filename(file_title))
-    missing_titles = list(local_titles - channel_filenames)
-    # 反查原始文件名用于展示
-    display_missing = []
-    for epub_path in glob.glob(os.path.join(category_path, "*.epub")):
-        file_title = os.path.splitext(os.path.basename(epub_path))[0]
-        if normalize_filename(file_title) in missing_titles:
-            display_missing.append(file_title)
+    display_missing = _get_missing_books(category)
     context.user_data['check_missing_titles'] = display_missing
     if not display_missing:
         await with_retry(query.message.reply_text, f"分类【{category}】与频道已同步，无需补发！", context=context)
@@ -924,22 +1134,25 @@ async def check_and_fill_confirm(update: Update, context: ContextTypes.DEFAULT_T
     check_channel_id = context.user_data.get('check_channel_id')
 
     # 新增：用 get_books_in_category 获取所有 txt 文件名，做智能匹配
-    txt_books = get_books_in_category(category)
-    txt_books_no_ext = [b[:-4] if b.endswith('.txt') else b for b in txt_books]
     # 建立 epub名->txt名 映射
+    txt_books = get_books_in_category(category)
     epub_to_txt = {b[:-4] if b.endswith('.txt') else b: b for b in txt_books}
 
-    for title in missing_titles:
+    # 有界并发补发：信号量限5路同时上传，不再每本固定等1.5秒；
+    # 流控由 AIORateLimiter 整流、with_retry 兜底
+    fill_sem = asyncio.Semaphore(5)
+
+    async def _fill_one(title):
         # 优先用 txt 文件名补发
-        txt_name = epub_to_txt.get(title)
-        if txt_name:
-            result = await upload_book(update, context, category, txt_name, force_channel_id=check_channel_id)
-        else:
-            result = await upload_book(update, context, category, title, force_channel_id=check_channel_id)
-        if result:
+        book_name = epub_to_txt.get(title, title)
+        async with fill_sem:
+            return await upload_book(update, context, category, book_name, force_channel_id=check_channel_id)
+
+    results = await asyncio.gather(*[_fill_one(t) for t in missing_titles], return_exceptions=True)
+    for title, result in zip(missing_titles, results):
+        if result is True:
             sent += 1
             await with_retry(query.message.reply_text, f"已补发：{title}", context=context)
-            await asyncio.sleep(1.5)
         else:
             await with_retry(query.message.reply_text, f"补发 {title} 失败", context=context)
     await with_retry(query.message.reply_text, f"分类【{category}】补发完成，共补发 {sent} 本！", context=context)
@@ -947,57 +1160,76 @@ async def check_and_fill_confirm(update: Update, context: ContextTypes.DEFAULT_T
 
 def main():
     """主函数，移除自动重启机制，/stop后能彻底退出"""
+    # uvloop可用时换掉默认selector事件循环，调度开销低得多
     try:
-        application = Application.builder().token(TOKEN).build()
-        # stop handler 必须最先注册，防止被吞掉
-        application.add_handler(CommandHandler("stop", stop))
-        application.add_handler(CommandHandler("start", start))
-        # 新增：主菜单按钮回调
-        application.add_handler(CallbackQueryHandler(menu_button_handler, pattern=r"^menu_"))
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("upload", upload), CommandHandler("upload_from", upload_from)],
-            states={
-                SELECTING_CHANNEL: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, channel_input)
-                ],
-                'UPLOAD_FROM_CHANNEL_INPUT': [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, upload_from_channel_input)
-                ],
-                SELECTING_CATEGORY: [
-                    CallbackQueryHandler(category_selected, pattern=r"^cat_")
-                ],
-                SELECTING_COUNT: [
-                    CallbackQueryHandler(count_selected, pattern=r"^count_|^back_to_categories$")
-                ],
-                SELECTING_BOOK: [
-                    CallbackQueryHandler(book_selected, pattern=r"^book_|^back_to_count$")
-                ],
-                SELECTING_CATEGORY_FROM: [
-                    CallbackQueryHandler(category_from_selected, pattern=r"^catfrom_")
-                ],
-                INPUT_SEARCH_KEYWORD: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, input_search_keyword)
-                ],
-                SELECTING_START_BOOK: [
-                    CallbackQueryHandler(select_start_book, pattern=r"^startbook_")
-                ],
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-        )
-        application.add_handler(conv_handler)
-        check_conv_handler = ConversationHandler(
-            entry_points=[
-                CommandHandler("check_and_fill", check_and_fill_entry),
-                CallbackQueryHandler(check_and_fill_entry, pattern=r"^menu_checkfill$")
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    # 主动按Telegram官方限速（约30条/秒，群组/频道约20条/分钟）整流，
+    # 避免触发429后再被动等待
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .rate_limiter(AIORateLimiter(
+            overall_max_rate=30,
+            overall_time_period=1,
+            group_max_rate=20,
+            group_time_period=60,
+            max_retries=MAX_RETRIES,
+        ))
+        .build()
+    )
+    # stop handler 必须最先注册，防止被吞掉
+    application.add_handler(CommandHandler("stop", stop))
+    application.add_handler(CommandHandler("start", start))
+    # 新增：主菜单按钮回调
+    application.add_handler(CallbackQueryHandler(menu_button_handler, pattern=r"^menu_"))
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("upload", upload), CommandHandler("upload_from", upload_from)],
+        states={
+            SELECTING_CHANNEL: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, channel_input)
             ],
-            states={
-                CHECK_CHANNEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_and_fill_channel_input)],
-                CHECK_CATEGORY: [CallbackQueryHandler(check_and_fill_category_selected, pattern=r"^checkcat_")],
-                CHECK_CONFIRM: [CallbackQueryHandler(check_and_fill_confirm, pattern=r"^checkconfirm_")],
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-        )
-        application.add_handler(check_conv_handler)
+            'UPLOAD_FROM_CHANNEL_INPUT': [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, upload_from_channel_input)
+            ],
+            SELECTING_CATEGORY: [
+                CallbackQueryHandler(category_selected, pattern=r"^cat_")
+            ],
+            SELECTING_COUNT: [
+                CallbackQueryHandler(count_selected, pattern=r"^count_|^back_to_categories$")
+            ],
+            SELECTING_BOOK: [
+                CallbackQueryHandler(book_selected, pattern=r"^book_|^back_to_count$")
+            ],
+            SELECTING_CATEGORY_FROM: [
+                CallbackQueryHandler(category_from_selected, pattern=r"^catfrom_")
+            ],
+            INPUT_SEARCH_KEYWORD: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, input_search_keyword)
+            ],
+            SELECTING_START_BOOK: [
+                CallbackQueryHandler(select_start_book, pattern=r"^startbook_")
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+    )
+    application.add_handler(conv_handler)
+    check_conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("check_and_fill", check_and_fill_entry),
+            CallbackQueryHandler(check_and_fill_entry, pattern=r"^menu_checkfill$")
+        ],
+        states={
+            CHECK_CHANNEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_and_fill_channel_input)],
+            CHECK_CATEGORY: [CallbackQueryHandler(check_and_fill_category_selected, pattern=r"^checkcat_")],
+            CHECK_CONFIRM: [CallbackQueryHandler(check_and_fill_confirm, pattern=r"^checkconfirm_")],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+    )
+    application.add_handler(check_conv_handler)
+    try:
         application.run_polling()
     except Exception as e:
         logger.error(f"主循环异常: {e}")
@@ -1,8 +1,9 @@
 from telethon import TelegramClient
 import asyncio
-import json
+import orjson
 import os
 import re
+import sys
 
 api_id = int(os.getenv('TG_API_ID'))
 api_hash = os.getenv('TG_API_HASH')
@@ -11,66 +12,143 @@ BATCH_SIZE = 100
 SYNC_INTERVAL = 300  # 每5分钟自动同步一次
 
 # 解析消息文本，提取标题和类型
-msg_title_re = re.compile(r'^标题[:：]\s*(.+)', re.MULTILINE)
-msg_type_re = re.compile(r'^类型[:：]\s*(.+)', re.MULTILINE)
+# 标题/类型合并为一个多行正则，对消息正文只扫一遍就拿到两个字段
+# 分类名 - 转 _ 的翻译表：C级单遍替换
+_DASH_TABLE = str.maketrans({'-': '_'})
+
+msg_field_re = re.compile(r'^(?:标题[:：]\s*(?P<title>.+)|类型[:：]\s*(?P<type>.+))', re.MULTILINE)
 
 def parse_title_and_category(text):
-    title_match = msg_title_re.search(text)
-    type_match = msg_type_re.search(text)
-    title = title_match.group(1).strip() if title_match else None
-    category = type_match.group(1).strip() if type_match else '未分类'
-    category = category.replace('-', '_')
-    return title, category
+    # 大多数消息根本不含字段头，先用C级substring检查挡掉，再走正则
+    if '标题' not in text and '类型' not in text:
+        return None, '未分类'
+    title = None
+    category = None
+    for m in msg_field_re.finditer(text):
+        if m.lastgroup == 'title':
+            if title is None:
+                title = m.group('title').strip()
+        elif category is None:
+            category = m.group('type').strip()
+        if title is not None and category is not None:
+            break
+    if category is None:
+        category = '未分类'
+    return title, category.translate(_DASH_TABLE)
 
 def load_titles():
     if os.path.exists('channel_titles.json'):
-        with open('channel_titles.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open('channel_titles.json', 'rb') as f:
+            return orjson.loads(f.read())
     return []
 
+class Entry:
+    """频道标题条目：__slots__实例比每条一个dict省下约3/4内存，
+    序列化时再转回dict"""
+    __slots__ = ('title', 'filename', 'category')
+
+    def __init__(self, title, filename, category):
+        self.title = title
+        self.filename = filename
+        self.category = category
+
 def save_titles(titles):
-    with open('channel_titles.json', 'w', encoding='utf-8') as f:
-        json.dump(titles, f, ensure_ascii=False, indent=2)
+    # orjson是C实现，整表序列化比标准库json快数倍，输出本身就是UTF-8
+    payload = [
+        {'title': e.title, 'filename': e.filename, 'category': e.category}
+        if isinstance(e, Entry) else e
+        for e in titles
+    ]
+    # 去重挪到落盘前一次性完成：抓取循环不再逐条维护全量seen集合，
+    # dict按插入序保留首次出现的条目
+    dedup = {}
+    for e in payload:
+        dedup.setdefault((e['title'], e['category']), e)
+    payload = list(dedup.values())
+    with open('channel_titles.json', 'wb') as f:
+        f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+
+# 同步进度元数据：记录已见过的最大消息id，供增量同步使用
+META_FILE = 'channel_titles.meta.json'
+
+def load_meta():
+    if os.path.exists(META_FILE):
+        with open(META_FILE, 'rb') as f:
+            return orjson.loads(f.read())
+    return {}
+
+def save_meta(meta):
+    with open(META_FILE, 'wb') as f:
+        f.write(orjson.dumps(meta))
+
+async def fetch_new_titles(client, channel, min_id):
+    """增量同步：只拉取 min_id 之后的新消息，新条目插到列表头部"""
+    titles = load_titles()
+    seen = {(e['title'], e['category']) for e in titles if isinstance(e, dict)}
+    new_entries = []
+    max_msg_id = min_id
+    async for message in client.iter_messages(channel, min_id=min_id):
+        if message.id and message.id > max_msg_id:
+            max_msg_id = message.id
+        if message.text:
+            title, category = parse_title_and_category(message.text)
+            if title:
+                key = (title, category)
+                if key not in seen:
+                    new_entries.append(Entry(title, title, category.lstrip('#')))
+                    seen.add(key)
+    if new_entries:
+        titles = new_entries + titles
+        save_titles(titles)
+    save_meta({'max_msg_id': max_msg_id})
+    print(f'增量同步完成，新增 {len(new_entries)} 条（共 {len(titles)} 条）')
+    return titles
 
 async def fetch_all_titles(client, channel):
     titles = []
-    seen = set()
     last_id = None
     total = 0
+    max_msg_id = 0
+    batch_count = 0
     while True:
         batch = []
         kwargs = {'limit': BATCH_SIZE}
         if last_id is not None:
             kwargs['max_id'] = last_id
         async for message in client.iter_messages(channel, **kwargs):
+            if message.id and message.id > max_msg_id:
+                max_msg_id = message.id
             if message.text:
                 title, category = parse_title_and_category(message.text)
                 if title:
-                    key = (title, category)
-                    if key not in seen:
-                        entry = {
-                            'title': title,
-                            'filename': title,
-                            'category': category.lstrip('#')
-                        }
-                        titles.append(entry)
-                        seen.add(key)
+                    titles.append(Entry(title, title, category.lstrip('#')))
                 batch.append(message)
         if not batch:
             break
         last_id = batch[-1].id if batch[-1].id is not None else 0
         total += len(batch)
+        batch_count += 1
         print(f"已拉取 {total} 条消息，当前已解析 {len(titles)} 条")
-        save_titles(titles)
+        # 每10个批次落盘一次即可，逐批全量重写会随列表增长产生O(N^2)写放大
+        if batch_count % 10 == 0:
+            save_titles(titles)
         await asyncio.sleep(1)
+    save_titles(titles)
+    save_meta({'max_msg_id': max_msg_id})
     print(f'历史消息同步完成，共拉取到 {len(titles)} 条带标题的消息')
     return titles
 
 async def main():
     client = TelegramClient('session_name', api_id, api_hash)
     await client.start()
-    print('开始首次全量同步...')
-    await fetch_all_titles(client, channel)
+    meta = load_meta()
+    # 已有同步进度时默认只拉新消息；--full 强制重新全量同步
+    if '--full' not in sys.argv and meta.get('max_msg_id'):
+        print(f"开始增量同步（从消息id {meta['max_msg_id']} 之后）...")
+        await fetch_new_titles(client, channel, meta['max_msg_id'])
+    else:
+        print('开始首次全量同步...')
+        await fetch_all_titles(client, channel)
 
 if __name__ == '__main__':
     asyncio.run(main()) 
\ No newline at end of file
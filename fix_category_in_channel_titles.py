@@ -1,14 +1,23 @@
-import json
+import ijson
+import orjson
+import os
 
+# 流式修复：逐条读入、去掉category的#前缀、逐条写出，
+# 内存占用与文件大小无关；写临时文件后原子替换，中断不会损坏原文件
 file = 'channel_titles.json'
-with open(file, 'r', encoding='utf-8') as f:
-    data = json.load(f)
+tmp = file + '.tmp'
 
-for entry in data:
-    if isinstance(entry, dict) and 'category' in entry:
-        entry['category'] = entry['category'].lstrip('#')
+count = 0
+with open(file, 'rb') as src, open(tmp, 'wb') as dst:
+    dst.write(b'[')
+    for entry in ijson.items(src, 'item'):
+        if isinstance(entry, dict) and 'category' in entry:
+            entry['category'] = entry['category'].lstrip('#')
+        if count:
+            dst.write(b',\n')
+        dst.write(orjson.dumps(entry))
+        count += 1
+    dst.write(b']')
 
-with open(file, 'w', encoding='utf-8') as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
-
-print('已批量去除所有category字段的#前缀') 
\ No newline at end of file
+os.replace(tmp, file)
+print(f'已批量去除所有category字段的#前缀（共 {count} 条）')